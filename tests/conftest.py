@@ -0,0 +1,18 @@
+import os
+from pathlib import Path
+
+import pytest
+
+TMPFS_ROOT = Path("/dev/shm")
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    # Keep pytest temporary directories on tmpfs for this session unless PYTEST_TMPFS=0; --basetemp still wins.
+    if (
+        os.environ.get("PYTEST_TMPFS") != "0"
+        and "PYTEST_DEBUG_TEMPROOT" not in os.environ
+        and os.access(TMPFS_ROOT, os.W_OK)
+    ):  # pragma: no branch
+        mp = pytest.MonkeyPatch()
+        config.add_cleanup(mp.undo)
+        mp.setenv("PYTEST_DEBUG_TEMPROOT", str(TMPFS_ROOT))
@@ -1,99 +1,244 @@
-from collections.abc import Callable
-from dataclasses import dataclass, field
+import json
+import shutil
+from collections.abc import Callable, Generator
+from dataclasses import dataclass
+from functools import cache
+from itertools import chain
 from pathlib import Path
 from typing import Any
 
 import pytest
-import tomli_w
 
 from hatch_cada.hook import CadaMetaHook
 
 
-@dataclass
+# json.dumps escapes quotes, backslashes and control characters the way TOML basic strings do. Non-ASCII
+# characters are written raw because TOML rejects the surrogate-pair escapes json uses outside the BMP,
+# and DEL, which TOML forbids unescaped, is escaped by hand.
+def _toml_string(value: str) -> str:
+    return json.dumps(value, ensure_ascii=False).replace("\x7f", "\\u007f")
+
+
+def _toml_array(values: tuple[str, ...]) -> str:
+    return f"[{', '.join(map(_toml_string, values))}]"
+
+
+@dataclass(frozen=True, slots=True)
 class ExternalPackage:
     name: str
     version: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class WorkspacePackage:
     name: str
     version: str
-    dependencies: list[str] = field(default_factory=list)
-    optional_dependencies: dict[str, list[str]] = field(default_factory=dict)
-
-    def pyproject(self) -> str:
-        data: dict[str, Any] = {"project": {"name": self.name, "version": self.version}}
-        if self.dependencies:
-            data["project"]["dependencies"] = self.dependencies
-        if self.optional_dependencies:
-            data["project"]["optional-dependencies"] = self.optional_dependencies
-        return tomli_w.dumps(data)
+    dependencies: tuple[str, ...] = ()
+    optional_dependencies: tuple[tuple[str, tuple[str, ...]], ...] = ()
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class WorkspaceConfig:
-    packages: list[WorkspacePackage]
-    locked_packages: list[ExternalPackage] = field(default_factory=list)
-    members: list[str] | None = None
-
-    def pyproject(self, members: list[str]) -> str:
-        data = {
-            "project": {"name": "workspace", "version": "0.0.0"},
-            "tool": {"uv": {"workspace": {"members": members}}},
-        }
-        return tomli_w.dumps(data)
-
-    def lockfile(self) -> str:
-        lines = ["version = 1", 'requires-python = ">=3.12"', ""]
-        for pkg in self.packages:
-            lines.extend(
-                [
-                    "[[package]]",
-                    f'name = "{pkg.name}"',
-                    f'version = "{pkg.version}"',
-                    f'source = {{ editable = "{pkg.name}" }}',
-                    "",
-                ]
-            )
-        for pkg in self.locked_packages:
-            lines.extend(
-                [
-                    "[[package]]",
-                    f'name = "{pkg.name}"',
-                    f'version = "{pkg.version}"',
-                    "",
-                ]
-            )
-        return "\n".join(lines)
+    packages: tuple[WorkspacePackage, ...]
+    locked_packages: tuple[ExternalPackage, ...] = ()
+    members: tuple[str, ...] | None = None
+
+
+@cache
+def _package_pyproject(pkg: WorkspacePackage) -> bytes:
+    text = f"[project]\nname = {_toml_string(pkg.name)}\nversion = {_toml_string(pkg.version)}\n"
+    if pkg.dependencies:
+        text += f"dependencies = {_toml_array(pkg.dependencies)}\n"
+    if pkg.optional_dependencies:
+        text += "\n[project.optional-dependencies]\n"
+        text += "".join(f"{_toml_string(group)} = {_toml_array(deps)}\n" for group, deps in pkg.optional_dependencies)
+    return text.encode()
+
+
+@cache
+def _workspace_pyproject(members: tuple[str, ...]) -> bytes:
+    return (
+        f'[project]\nname = "workspace"\nversion = "0.0.0"\n\n[tool.uv.workspace]\nmembers = {_toml_array(members)}\n'
+    ).encode()
+
+
+@cache
+def _lockfile(config: WorkspaceConfig) -> bytes:
+    return "".join(
+        chain(
+            ('version = 1\nrequires-python = ">=3.12"\n',),
+            (
+                f"\n[[package]]\nname = {_toml_string(pkg.name)}\nversion = {_toml_string(pkg.version)}\n"
+                f"source = {{ editable = {_toml_string(pkg.name)} }}\n"
+                for pkg in config.packages
+            ),
+            (
+                f"\n[[package]]\nname = {_toml_string(pkg.name)}\nversion = {_toml_string(pkg.version)}\n"
+                for pkg in config.locked_packages
+            ),
+        )
+    ).encode()
 
 
 WorkspaceFactory = Callable[[WorkspaceConfig], Path]
 
 
+def build_workspace(workspace_root: Path, config: WorkspaceConfig) -> None:
+    workspace_root.mkdir()
+    members = config.members if config.members is not None else tuple(pkg.name for pkg in config.packages)
+    (workspace_root / "pyproject.toml").write_bytes(_workspace_pyproject(members))
+    for pkg in config.packages:
+        pkg_path = workspace_root / pkg.name
+        pkg_path.mkdir()
+        (pkg_path / "pyproject.toml").write_bytes(_package_pyproject(pkg))
+    (workspace_root / "uv.lock").write_bytes(_lockfile(config))
+
+
+@pytest.fixture(scope="session")
+def workspace_templates() -> dict[WorkspaceConfig, Path]:
+    return {}
+
+
+@pytest.fixture(scope="module")
+def workspace_root(tmp_path_factory: pytest.TempPathFactory) -> Generator[Path, None, None]:
+    root = tmp_path_factory.mktemp("workspace_root") / "workspace"
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("WORKSPACE_ROOT", str(root))
+        yield root
+
+
 @pytest.fixture
-def workspace_factory(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> WorkspaceFactory:
+def workspace_factory(
+    tmp_path_factory: pytest.TempPathFactory,
+    workspace_templates: dict[WorkspaceConfig, Path],
+    workspace_root: Path,
+) -> WorkspaceFactory:
+    # WORKSPACE_ROOT is fixed for the module, so only one workspace is live at a time:
+    # each call replaces the directory returned by the previous one.
     def _create(config: WorkspaceConfig) -> Path:
-        workspace_root = tmp_path / "workspace"
-        workspace_root.mkdir()
-        members = config.members if config.members is not None else [pkg.name for pkg in config.packages]
-        (workspace_root / "pyproject.toml").write_text(config.pyproject(members))
-        for pkg in config.packages:
-            pkg_path = workspace_root / pkg.name
-            pkg_path.mkdir(parents=True, exist_ok=True)
-            (pkg_path / "pyproject.toml").write_text(pkg.pyproject())
-        (workspace_root / "uv.lock").write_text(config.lockfile())
-        monkeypatch.setenv("WORKSPACE_ROOT", str(workspace_root))
+        template = workspace_templates.get(config)
+        if template is None:
+            template = tmp_path_factory.mktemp("template") / "workspace"
+            build_workspace(template, config)
+            workspace_templates[config] = template
+        if workspace_root.exists():
+            shutil.rmtree(workspace_root)
+        shutil.copytree(template, workspace_root)
         return workspace_root
 
     return _create
 
 
 def create_hook(root: Path, config: dict | None = None) -> CadaMetaHook:
-    hook = CadaMetaHook.__new__(CadaMetaHook)
-    hook._MetadataHookInterface__root = str(root)  # pyright: ignore[reportAttributeAccessIssue]
-    hook._MetadataHookInterface__config = config or {}  # pyright: ignore[reportAttributeAccessIssue]
-    return hook
+    return CadaMetaHook(str(root), config or {})
+
+
+WORKSPACE_WITH_DEP = WorkspaceConfig(
+    packages=(
+        WorkspacePackage("main", "1.0.0", dependencies=("dep",)),
+        WorkspacePackage("dep", "2.0.0"),
+    )
+)
+WORKSPACE_WITH_0X_DEP = WorkspaceConfig(
+    packages=(
+        WorkspacePackage("main", "1.0.0", dependencies=("dep",)),
+        WorkspacePackage("dep", "0.2.0"),
+    )
+)
+
+REWRITE_DEPENDENCIES_CASES: tuple[tuple[str, WorkspaceConfig, dict, dict[str, Any]], ...] = (
+    (
+        "preserves_external_dep",
+        WorkspaceConfig(
+            packages=(WorkspacePackage("main", "1.0.0", dependencies=("requests>=2.0",)),),
+            locked_packages=(ExternalPackage("requests", "2.31.0"),),
+        ),
+        {"strategy": "allow-all-updates"},
+        {"name": "main", "dependencies": ["requests>=2.0"]},
+    ),
+    (
+        "preserves_extras",
+        WorkspaceConfig(
+            packages=(
+                WorkspacePackage("main", "1.0.0", dependencies=("dep-with-extras[extra1,extra2]",)),
+                WorkspacePackage("dep-with-extras", "4.0.0", optional_dependencies=(("extra1", ()), ("extra2", ()))),
+            )
+        ),
+        {"strategy": "pin"},
+        {"name": "main", "dependencies": ["dep-with-extras[extra1,extra2]==4.0.0"]},
+    ),
+    (
+        "preserves_python_marker",
+        WorkspaceConfig(
+            packages=(
+                WorkspacePackage("main", "1.0.0", dependencies=('dep ; python_version >= "3.10"',)),
+                WorkspacePackage("dep", "2.0.0"),
+            )
+        ),
+        {"strategy": "pin"},
+        {"name": "main", "dependencies": ['dep==2.0.0; python_version >= "3.10"']},
+    ),
+    (
+        "preserves_platform_marker",
+        WorkspaceConfig(
+            packages=(
+                WorkspacePackage("main", "1.0.0", dependencies=('dep ; sys_platform == "linux"',)),
+                WorkspacePackage("dep", "2.0.0"),
+            )
+        ),
+        {"strategy": "pin"},
+        {"name": "main", "dependencies": ['dep==2.0.0; sys_platform == "linux"']},
+    ),
+    (
+        "preserves_extras_and_marker",
+        WorkspaceConfig(
+            packages=(
+                WorkspacePackage("main", "1.0.0", dependencies=('dep[extra1] ; python_version >= "3.11"',)),
+                WorkspacePackage("dep", "2.0.0", optional_dependencies=(("extra1", ()),)),
+            )
+        ),
+        {"strategy": "pin"},
+        {"name": "main", "dependencies": ['dep[extra1]==2.0.0; python_version >= "3.11"']},
+    ),
+    (
+        "override_strategy",
+        WorkspaceConfig(
+            packages=(
+                WorkspacePackage("main", "1.0.0", dependencies=("dep", "dep-with-extras[extra1,extra2]")),
+                WorkspacePackage("dep", "2.0.0"),
+                WorkspacePackage("dep-with-extras", "4.0.0", optional_dependencies=(("extra1", ()), ("extra2", ()))),
+            )
+        ),
+        {"strategy": "allow-all-updates", "overrides": {"dep": "pin"}},
+        {"name": "main", "dependencies": ["dep==2.0.0", "dep-with-extras[extra1,extra2]>=4.0.0"]},
+    ),
+    (
+        "optional_deps",
+        WorkspaceConfig(
+            packages=(
+                WorkspacePackage("main", "1.0.0", optional_dependencies=(("dev", ("opt-dep",)),)),
+                WorkspacePackage("opt-dep", "3.0.0"),
+            )
+        ),
+        {"strategy": "pin"},
+        {"name": "main", "optional-dependencies": {"dev": ["opt-dep==3.0.0"]}},
+    ),
+    (
+        "preserves_external_optional_dep",
+        WorkspaceConfig(
+            packages=(WorkspacePackage("main", "1.0.0", optional_dependencies=(("dev", ("pytest>=7.0",)),)),),
+            locked_packages=(ExternalPackage("pytest", "8.0.0"),),
+        ),
+        {"strategy": "allow-all-updates"},
+        {"name": "main", "optional-dependencies": {"dev": ["pytest>=7.0"]}},
+    ),
+    (
+        "no_deps",
+        WorkspaceConfig(packages=(WorkspacePackage("main", "1.0.0"),)),
+        {"strategy": "allow-all-updates"},
+        {"name": "main"},
+    ),
+)
 
 
 class TestCadaMetaHook:
@@ -126,165 +271,64 @@ class TestCadaMetaHook:
     def test_raises_for_invalid_config(
         self, workspace_factory: WorkspaceFactory, hook_config: dict, error_match: str
     ) -> None:
-        workspace = workspace_factory(
-            WorkspaceConfig(
-                packages=[
-                    WorkspacePackage("main", "1.0.0", dependencies=["dep"]),
-                    WorkspacePackage("dep", "2.0.0"),
-                ]
-            )
-        )
+        workspace = workspace_factory(WORKSPACE_WITH_DEP)
         hook = create_hook(workspace / "main", hook_config)
 
         with pytest.raises(ValueError, match=error_match):
             hook.update({"name": "main"})
 
     @pytest.mark.parametrize(
-        ("strategy", "dep_version", "expected_metadata"),
-        [
-            pytest.param("pin", "2.0.0", {"name": "main", "dependencies": ["dep==2.0.0"]}, id="pin"),
-            pytest.param(
-                "allow-patch-updates", "2.0.0", {"name": "main", "dependencies": ["dep<2.1.0,>=2.0.0"]}, id="patch"
-            ),
-            pytest.param(
-                "allow-minor-updates", "2.0.0", {"name": "main", "dependencies": ["dep<3.0.0,>=2.0.0"]}, id="minor"
-            ),
-            pytest.param("allow-all-updates", "2.0.0", {"name": "main", "dependencies": ["dep>=2.0.0"]}, id="all"),
-            pytest.param("semver", "2.0.0", {"name": "main", "dependencies": ["dep<3.0.0,>=2.0.0"]}, id="semver"),
-            pytest.param("semver", "0.2.0", {"name": "main", "dependencies": ["dep<0.3.0,>=0.2.0"]}, id="semver_0x"),
-        ],
-    )
-    def test_applies_strategy(
-        self, workspace_factory: WorkspaceFactory, strategy: str, dep_version: str, expected_metadata: dict[str, Any]
-    ) -> None:
-        workspace = workspace_factory(
-            WorkspaceConfig(
-                packages=[
-                    WorkspacePackage("main", "1.0.0", dependencies=["dep"]),
-                    WorkspacePackage("dep", dep_version),
-                ]
-            )
-        )
-        hook = create_hook(workspace / "main", {"strategy": strategy})
-        metadata: dict[str, Any] = {"name": "main"}
-
-        hook.update(metadata)
-
-        assert metadata == expected_metadata
-
-    @pytest.mark.parametrize(
-        ("workspace_config", "hook_config", "expected_metadata"),
+        ("strategy", "workspace_config", "expected_metadata"),
         [
+            pytest.param("pin", WORKSPACE_WITH_DEP, {"name": "main", "dependencies": ["dep==2.0.0"]}, id="pin"),
             pytest.param(
-                WorkspaceConfig(
-                    packages=[WorkspacePackage("main", "1.0.0", dependencies=["requests>=2.0"])],
-                    locked_packages=[ExternalPackage("requests", "2.31.0")],
-                ),
-                {"strategy": "allow-all-updates"},
-                {"name": "main", "dependencies": ["requests>=2.0"]},
-                id="preserves_external_dep",
-            ),
-            pytest.param(
-                WorkspaceConfig(
-                    packages=[
-                        WorkspacePackage("main", "1.0.0", dependencies=["dep-with-extras[extra1,extra2]"]),
-                        WorkspacePackage(
-                            "dep-with-extras", "4.0.0", optional_dependencies={"extra1": [], "extra2": []}
-                        ),
-                    ]
-                ),
-                {"strategy": "pin"},
-                {"name": "main", "dependencies": ["dep-with-extras[extra1,extra2]==4.0.0"]},
-                id="preserves_extras",
-            ),
-            pytest.param(
-                WorkspaceConfig(
-                    packages=[
-                        WorkspacePackage("main", "1.0.0", dependencies=['dep ; python_version >= "3.10"']),
-                        WorkspacePackage("dep", "2.0.0"),
-                    ]
-                ),
-                {"strategy": "pin"},
-                {"name": "main", "dependencies": ['dep==2.0.0; python_version >= "3.10"']},
-                id="preserves_python_marker",
-            ),
-            pytest.param(
-                WorkspaceConfig(
-                    packages=[
-                        WorkspacePackage("main", "1.0.0", dependencies=['dep ; sys_platform == "linux"']),
-                        WorkspacePackage("dep", "2.0.0"),
-                    ]
-                ),
-                {"strategy": "pin"},
-                {"name": "main", "dependencies": ['dep==2.0.0; sys_platform == "linux"']},
-                id="preserves_platform_marker",
+                "allow-patch-updates",
+                WORKSPACE_WITH_DEP,
+                {"name": "main", "dependencies": ["dep<2.1.0,>=2.0.0"]},
+                id="patch",
             ),
             pytest.param(
-                WorkspaceConfig(
-                    packages=[
-                        WorkspacePackage("main", "1.0.0", dependencies=['dep[extra1] ; python_version >= "3.11"']),
-                        WorkspacePackage("dep", "2.0.0", optional_dependencies={"extra1": []}),
-                    ]
-                ),
-                {"strategy": "pin"},
-                {"name": "main", "dependencies": ['dep[extra1]==2.0.0; python_version >= "3.11"']},
-                id="preserves_extras_and_marker",
+                "allow-minor-updates",
+                WORKSPACE_WITH_DEP,
+                {"name": "main", "dependencies": ["dep<3.0.0,>=2.0.0"]},
+                id="minor",
             ),
             pytest.param(
-                WorkspaceConfig(
-                    packages=[
-                        WorkspacePackage("main", "1.0.0", dependencies=["dep", "dep-with-extras[extra1,extra2]"]),
-                        WorkspacePackage("dep", "2.0.0"),
-                        WorkspacePackage(
-                            "dep-with-extras", "4.0.0", optional_dependencies={"extra1": [], "extra2": []}
-                        ),
-                    ]
-                ),
-                {"strategy": "allow-all-updates", "overrides": {"dep": "pin"}},
-                {"name": "main", "dependencies": ["dep==2.0.0", "dep-with-extras[extra1,extra2]>=4.0.0"]},
-                id="override_strategy",
+                "allow-all-updates", WORKSPACE_WITH_DEP, {"name": "main", "dependencies": ["dep>=2.0.0"]}, id="all"
             ),
             pytest.param(
-                WorkspaceConfig(
-                    packages=[
-                        WorkspacePackage("main", "1.0.0", optional_dependencies={"dev": ["opt-dep"]}),
-                        WorkspacePackage("opt-dep", "3.0.0"),
-                    ]
-                ),
-                {"strategy": "pin"},
-                {"name": "main", "optional-dependencies": {"dev": ["opt-dep==3.0.0"]}},
-                id="optional_deps",
+                "semver", WORKSPACE_WITH_DEP, {"name": "main", "dependencies": ["dep<3.0.0,>=2.0.0"]}, id="semver"
             ),
             pytest.param(
-                WorkspaceConfig(
-                    packages=[
-                        WorkspacePackage("main", "1.0.0", optional_dependencies={"dev": ["pytest>=7.0"]}),
-                    ],
-                    locked_packages=[ExternalPackage("pytest", "8.0.0")],
-                ),
-                {"strategy": "allow-all-updates"},
-                {"name": "main", "optional-dependencies": {"dev": ["pytest>=7.0"]}},
-                id="preserves_external_optional_dep",
-            ),
-            pytest.param(
-                WorkspaceConfig(packages=[WorkspacePackage("main", "1.0.0")]),
-                {"strategy": "allow-all-updates"},
-                {"name": "main"},
-                id="no_deps",
+                "semver",
+                WORKSPACE_WITH_0X_DEP,
+                {"name": "main", "dependencies": ["dep<0.3.0,>=0.2.0"]},
+                id="semver_0x",
             ),
         ],
     )
-    def test_rewrites_dependencies(
+    def test_applies_strategy(
         self,
         workspace_factory: WorkspaceFactory,
+        strategy: str,
         workspace_config: WorkspaceConfig,
-        hook_config: dict,
         expected_metadata: dict[str, Any],
     ) -> None:
         workspace = workspace_factory(workspace_config)
-        hook = create_hook(workspace / "main", hook_config)
+        hook = create_hook(workspace / "main", {"strategy": strategy})
         metadata: dict[str, Any] = {"name": "main"}
 
         hook.update(metadata)
 
         assert metadata == expected_metadata
+
+    def test_rewrites_dependencies(self, workspace_factory: WorkspaceFactory, subtests: pytest.Subtests) -> None:
+        for case_id, workspace_config, hook_config, expected_metadata in REWRITE_DEPENDENCIES_CASES:
+            with subtests.test(case_id):
+                workspace = workspace_factory(workspace_config)
+                hook = create_hook(workspace / "main", hook_config)
+                metadata: dict[str, Any] = {"name": "main"}
+
+                hook.update(metadata)
+
+                assert metadata == expected_metadata